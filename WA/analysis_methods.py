@@ -1,8 +1,10 @@
+from typing import Dict
+
 import pandas as pd
 from data_structures import Weather
 
 
-def analysis_tasks(weather: Weather, output_folder: str) -> None:
+def analysis_tasks(weather: Weather, output_folder: str) -> Dict[str, pd.Series]:
     """Post processing analysis.
 
     Calculate:
@@ -11,28 +13,30 @@ def analysis_tasks(weather: Weather, output_folder: str) -> None:
     - city and day with a maximum difference between the maximum and minimum temperature.
     - city with maximum change in maximum temperature;
 
+    Every result is saved to `output_folder` as `CSV` file named by its key.
+
     Args:
         weather (Weather): Weather class object.
         output_folder (str): The path to desired folder for data export.
+
+    Returns:
+        Dict with results of every analysis task.
     """
     weather_df = weather.df
-    # city/day with max and min temp
-    get_city_and_day_with_min_temp(weather_df).to_csv(
-        path_or_buf=(output_folder + r"\coldest_city_and_day.csv")
-    )
-    get_city_and_day_with_max_temp(weather_df).to_csv(
-        path_or_buf=(output_folder + r"\hottest_city_and_day.csv")
-    )
-
-    # city with max temp change during the day
-    get_max_daily_temp_change(weather_df).to_csv(
-        path_or_buf=(output_folder + r"\biggest_daily_temp_change_city_and_day.csv")
-    )
-
-    # city with biggest max temp change
-    get_city_with_biggest_max_temp_change(weather_df).to_csv(
-        path_or_buf=(output_folder + r"\biggest_max_temp_change_city_and_day.csv")
-    )
+    results = {
+        # city/day with max and min temp
+        "coldest_city_and_day": get_city_and_day_with_min_temp(weather_df),
+        "hottest_city_and_day": get_city_and_day_with_max_temp(weather_df),
+        # city with max temp change during the day
+        "biggest_daily_temp_change_city_and_day": get_max_daily_temp_change(weather_df),
+        # city with biggest max temp change
+        "biggest_max_temp_change_city_and_day": get_city_with_biggest_max_temp_change(
+            weather_df
+        ),
+    }
+    for name, result in results.items():
+        result.to_csv(path_or_buf=(output_folder + f"\\{name}.csv"))
+    return results
 
 
 def get_city_and_day_with_max_temp(weather_df: pd.DataFrame):
@@ -1,26 +1,24 @@
 import asyncio
 import zipfile
 from datetime import datetime, timedelta
-from functools import partial
-from multiprocessing import Pool
-from typing import List, Tuple
+from http import HTTPStatus
+from typing import Dict, List, Optional, Tuple
 
 import aiohttp
 import pandas as pd
+from geocoders import Geocoder, NominatimGeocoder
 from geopy.exc import GeocoderServiceError
-from geopy.geocoders import Nominatim
-from keys import API_OW
+from keys import API_OW_KEYS
+from scheduler import RequestScheduler
 
 pd.set_option("isplay.max_rows", None)
 pd.set_option("display.max_columns", 10)
 pd.set_option("display.width", 1600)
 
-#  prep geolocator
-geolocator = Nominatim(user_agent="nvm")
-reverse_coords = partial(geolocator.reverse, language="en", timeout=5)
-
 ow_url_forecast = "http://api.openweathermap.org/data/2.5/forecast"
 ow_url_historical = "http://api.openweathermap.org/data/2.5/onecall/timemachine"
+# 5 days of historical weather and forecast
+requests_per_city = 6
 
 
 class Hotels:
@@ -40,21 +38,28 @@ class Hotels:
         """
         self.df = prepare_data(path)
 
-    def fill_address(self, processes: int) -> None:
+    def fill_address(self, processes: int, geocoder: Optional[Geocoder] = None) -> None:
         """Fill addresses in given dataframe.
 
         Incorrect country and city data will be fixed at the process.
 
         Args:
             processes (int): Number of processes to run.
+            geocoder (Geocoder): Reverse geocoding backend. `NominatimGeocoder` is used by default.
         """
+        default_geocoder = geocoder is None
+        if default_geocoder:
+            geocoder = NominatimGeocoder(processes)
         try:
-            result = run_pool_of_address_workers(self.df, processes)
-            self.df["Address"] = [item[0] for item in result]
-            self.df["Country"] = [item[1] for item in result]
-            self.df["City"] = [item[2] for item in result]
+            result = geocoder.reverse(self.df)
+            self.df["Address"] = result["Address"]
+            self.df["Country"] = result["Country"]
+            self.df["City"] = result["City"]
         except GeocoderServiceError:
             quit()
+        finally:
+            if default_geocoder:
+                geocoder.close()
 
     def __str__(self):
         return str(self.df)
@@ -104,48 +109,6 @@ def prepare_data(base: str) -> pd.DataFrame:
     return df  # [300:310]  # SHORTENED!!!!
 
 
-def run_pool_of_address_workers(df: pd.DataFrame, processes: int) -> List:
-    """Run address_worker method in the multiprocessing pool.
-
-    Form a list of correct addresses, country codes and cities for given dataframe
-    in multiprocessing mode.
-
-    Args:
-        df (pd.DataFrame): Dataframe to process.
-        processes (int): Number of processes to run.
-
-    Returns:
-        List of tuples with address, county code and city for every line in dataframe.
-    """
-    with Pool(processes=processes) as pool:
-        return pool.map(address_worker, zip(df["Address"], df["City"]))
-
-
-def address_worker(data: Tuple) -> Tuple:
-    """Get the address, country code and city for given coordinates.
-
-    Args:
-        data (Tuple): Tuple of coordinates concatenated as strings and original `City`
-
-    Returns:
-        Tuple with valid address, country code and city for given coordinates.
-    """
-    coordinates_as_string = data[0]
-    original_city = data[1]
-    location = reverse_coords(coordinates_as_string)
-    country_code = location.raw["address"]["country_code"].upper()
-
-    if "city" in location.raw["address"]:
-        city = location.raw["address"]["city"]
-    elif "town" in location.raw["address"]:
-        city = location.raw["address"]["town"]
-    elif "village" in location.raw["address"]:
-        city = location.raw["address"]["village"]
-    else:
-        city = original_city
-    return location.address, country_code, city
-
-
 class CityCentres:
     """Data structure with information about every city centre.
 
@@ -215,117 +178,193 @@ class Weather:
         df (pd.DataFrame): Dataframe with city and weather information.
     """
 
-    def __init__(self, city_centres: CityCentres):
+    def __init__(
+        self,
+        city_centres: CityCentres,
+        scheduler: Optional[RequestScheduler] = None,
+        df: Optional[pd.DataFrame] = None,
+    ):
         """Form main dataframe with weather information for every city centre.
 
         Args:
             city_centres (CityCentres): CityCentres class object.
+            scheduler (RequestScheduler): Scheduler of requests to `openweathermap.org`.
+                Scheduler for keys from `keys.API_OW_KEYS` is used by default.
+            df (pd.DataFrame): Weather data gathered before.
+                Nothing is requested from `openweathermap.org` if it is given.
         """
-        self.df = asyncio.run(get_weather(city_centres))
+        if df is None:
+            df = asyncio.run(get_weather(city_centres, scheduler=scheduler))
+        self.df = df
 
     def __str__(self):
         return str(self.df)
 
 
-async def get_weather(city_centres: CityCentres) -> pd.DataFrame:
+async def get_weather(
+    city_centres: CityCentres,
+    session: Optional[aiohttp.ClientSession] = None,
+    scheduler: Optional[RequestScheduler] = None,
+) -> pd.DataFrame:
     """Collect 11 days weather data for every city centre.
 
-    Weather data will be asynchronously gathered from `openweathermap.org`
+    Weather data will be asynchronously gathered from `openweathermap.org`,
+    requests for the nearest days go first.
+    If any request fails, the rest of them are cancelled.
 
     Args:
         city_centres (CityCentres): CityCentres class object
+        session (aiohttp.ClientSession): Session to reuse. New one is opened and closed by default.
+        scheduler (RequestScheduler): Scheduler of requests to `openweathermap.org`.
+            Scheduler for keys from `keys.API_OW_KEYS` is used by default.
 
     Returns:
         Dataframe with city, day and temperature data.
     """
+    if scheduler is None:
+        scheduler = RequestScheduler(API_OW_KEYS)
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await get_weather(city_centres, session, scheduler)
+
     tasks = []
-    async with aiohttp.ClientSession() as session:
-        for row in city_centres.df.itertuples():
-            tasks.append(asyncio.create_task(get_historical_weather(session, row)))
-            tasks.append(asyncio.create_task(get_forecast(session, row)))
+    for row in city_centres.df.itertuples():
+        for days_ago in range(5, 0, -1):
+            tasks.append(
+                asyncio.create_task(
+                    get_historical_weather(session, row, scheduler, days_ago)
+                )
+            )
+        tasks.append(asyncio.create_task(get_forecast(session, row, scheduler)))
+    try:
         result = await asyncio.gather(*tasks)
-        weather = [row for item in result for row in item]
-        return pd.DataFrame(weather)
+    except BaseException:
+        # do not leave requests running after the failure
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        scheduler.save_usage()
+    weather = [row for item in result for row in item]
+    return pd.DataFrame(weather)
+
+
+async def get_ow_json(
+    session: aiohttp.ClientSession,
+    url: str,
+    params: List[Tuple],
+    scheduler: RequestScheduler,
+    priority: int,
+) -> Dict:
+    """Request `openweathermap.org` with the key given by scheduler.
+
+    Request rejected by rate limit is repeated with another key.
+
+    Args:
+        session (aiohttp.ClientSession): Shared aiohttp.ClientSession.
+        url (str): API url.
+        params (List[Tuple]): Request parameters without API key.
+        scheduler (RequestScheduler): Scheduler of requests to `openweathermap.org`.
+        priority (int): Priority of the request, lower value goes first.
+
+    Returns:
+        Decoded response.
+    """
+    while True:
+        key = await scheduler.acquire(priority)
+        throttled = False
+        try:
+            async with session.get(url, params=params + [("appid", key)]) as resp:
+                throttled = resp.status == HTTPStatus.TOO_MANY_REQUESTS
+                if not throttled:
+                    return await resp.json()
+        finally:
+            await scheduler.release(key, throttled)
 
 
 async def get_forecast(
-    session: aiohttp.ClientSession, row: "pd.core.frame.Pandas"
+    session: aiohttp.ClientSession,
+    row: "pd.core.frame.Pandas",
+    scheduler: RequestScheduler,
 ) -> List:
     """Collect current weather and 5 days weather forecast.
 
     Args:
         session (aiohttp.ClientSession): Shared aiohttp.ClientSession.
         row (pd.core.frame.Pandas): Line from dataframe.
+        scheduler (RequestScheduler): Scheduler of requests to `openweathermap.org`.
 
     Returns:
         List of dicts with city, day, and current, min, and max temperature.
     """
-    async with session.get(
+    forecast = await get_ow_json(
+        session,
         ow_url_forecast,
-        params=[
+        [
             ("lat", row.center_lat),
             ("lon", row.center_lon),
-            ("appid", API_OW),
             ("units", "metric"),
         ],
-    ) as resp:
-        city_weather = []
-        forecast = await resp.json()
-        for item in (forecast["list"][index] for index in (0, 8, 16, 24, 32, 39)):
-            city_weather.append(
-                {
-                    "city": row.Index,
-                    "day": datetime.fromtimestamp(item["dt"]).date(),
-                    "temp": item["main"]["temp"],
-                    "temp_min": item["main"]["temp_min"],
-                    "temp_max": item["main"]["temp_max"],
-                }
-            )
-        return city_weather
+        scheduler,
+        priority=0,
+    )
+    city_weather = []
+    for item in (forecast["list"][index] for index in (0, 8, 16, 24, 32, 39)):
+        city_weather.append(
+            {
+                "city": row.Index,
+                "day": datetime.fromtimestamp(item["dt"]).date(),
+                "temp": item["main"]["temp"],
+                "temp_min": item["main"]["temp_min"],
+                "temp_max": item["main"]["temp_max"],
+            }
+        )
+    return city_weather
 
 
 async def get_historical_weather(
-    session: aiohttp.ClientSession, row: "pd.core.frame.Pandas"
+    session: aiohttp.ClientSession,
+    row: "pd.core.frame.Pandas",
+    scheduler: RequestScheduler,
+    days_ago: int,
 ) -> List:
-    """Collect 5 days historical weather data.
+    """Collect historical weather data for a single day.
 
-    By the limitations from `openweathermap.org` 5 separate requests have to be done.
+    By the limitations from `openweathermap.org` every day needs separate request.
     https://openweathermap.org/api/one-call-api#history
 
     Args:
         session (aiohttp.ClientSession): Shared aiohttp.ClientSession.
         row (pd.core.frame.Pandas): Line from dataframe.
+        scheduler (RequestScheduler): Scheduler of requests to `openweathermap.org`.
+        days_ago (int): Number of days before today.
 
     Returns:
         List of dicts with city, day, and current, min, and max temperature.
     """
-    date_stamps = [
-        int(datetime.timestamp(datetime.today() - timedelta(days=i)))
-        for i in range(5, 0, -1)
+    date = int(datetime.timestamp(datetime.today() - timedelta(days=days_ago)))
+    forecast = await get_ow_json(
+        session,
+        ow_url_historical,
+        [
+            ("lat", row.center_lat),
+            ("lon", row.center_lon),
+            ("dt", date),
+            ("units", "metric"),
+        ],
+        scheduler,
+        priority=days_ago,
+    )
+    temp = forecast["current"]["temp"]
+    temp_min = min(item["temp"] for item in forecast["hourly"])
+    temp_max = max(item["temp"] for item in forecast["hourly"])
+    return [
+        {
+            "city": row.Index,
+            "day": datetime.fromtimestamp(forecast["current"]["dt"]).date(),
+            "temp": temp,
+            "temp_min": temp_min,
+            "temp_max": temp_max,
+        }
     ]
-    city_weather = []
-    for date in date_stamps:
-        async with session.get(
-            ow_url_historical,
-            params=[
-                ("lat", row.center_lat),
-                ("lon", row.center_lon),
-                ("dt", date),
-                ("appid", API_OW),
-                ("units", "metric"),
-            ],
-        ) as resp:
-            forecast = await resp.json()
-            temp = forecast["current"]["temp"]
-            temp_min = min(item["temp"] for item in forecast["hourly"])
-            temp_max = max(item["temp"] for item in forecast["hourly"])
-            city_weather.append(
-                {
-                    "city": row.Index,
-                    "day": datetime.fromtimestamp(forecast["current"]["dt"]).date(),
-                    "temp": temp,
-                    "temp_min": temp_min,
-                    "temp_max": temp_max,
-                }
-            )
-    return city_weather
@@ -41,7 +41,7 @@ def save_plots(weather: Weather, output_folder: str) -> None:
         weather (Weather): Weather class object.
         output_folder (str): The path to desired folder for data export.
     """
-    grouped = weather.df.groupby(["city"])
+    grouped = weather.df.groupby("city")
     for label, group in grouped:
         country, city = label[0], label[1]
         file_path = (
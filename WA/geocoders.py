@@ -0,0 +1,247 @@
+import csv
+from abc import ABC, abstractmethod
+from functools import partial
+from multiprocessing import Pool
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+from geopy.geocoders import Nominatim
+from scipy.spatial import cKDTree
+
+#  prep geolocator
+geolocator = Nominatim(user_agent="nvm")
+reverse_coords = partial(geolocator.reverse, language="en", timeout=5)
+
+# columns of GeoNames `geoname` table dump (`cities500.txt`, `allCountries.txt`, etc.)
+geonames_columns = {
+    1: "name",
+    4: "latitude",
+    5: "longitude",
+    6: "feature_class",
+    7: "feature_code",
+    8: "country_code",
+}
+# sections of populated places, historical, abandoned and destroyed places
+skipped_feature_codes = ["PPLX", "PPLH", "PPLQ", "PPLW"]
+
+
+class Geocoder(ABC):
+    """Base class for the reverse geocoding backends used by `Hotels.fill_address`.
+
+    Backend gets the whole hotels dataframe at once and returns address,
+    country code and city for every line of it.
+    """
+
+    @abstractmethod
+    def reverse(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Get address, country code and city for every line in dataframe.
+
+        Args:
+            df (pd.DataFrame): Dataframe with `Latitude`, `Longitude`, `Address` and `City` columns.
+
+        Returns:
+            Dataframe with `Address`, `Country` and `City` columns and the same index.
+        """
+
+    def close(self) -> None:
+        """Release resources of the backend."""
+
+
+class NominatimGeocoder(Geocoder):
+    """Online backend, asks `Nominatim` for the full street address of every hotel.
+
+    Pool of processes is started at the first request and kept till `close`.
+
+    Attributes:
+        processes (int): Number of processes to run.
+        pool (Pool): Pool of address workers.
+    """
+
+    def __init__(self, processes: int):
+        """Set up the backend.
+
+        Args:
+            processes (int): Number of processes to run.
+        """
+        self.processes = processes
+        self.pool = None
+
+    def reverse(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Get full address, country code and city for every line in dataframe.
+
+        Args:
+            df (pd.DataFrame): Dataframe with `Address` and `City` columns.
+
+        Returns:
+            Dataframe with `Address`, `Country` and `City` columns and the same index.
+        """
+        if self.pool is None:
+            self.pool = Pool(processes=self.processes)
+        result = run_pool_of_address_workers(df, self.pool)
+        return pd.DataFrame(
+            result, columns=["Address", "Country", "City"], index=df.index
+        )
+
+    def close(self) -> None:
+        """Stop pool of address workers."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+class OfflineGeocoder(Geocoder):
+    """Offline backend, resolves country code and nearest city from local places file.
+
+    Places file is a GeoNames-style tab separated dump without header
+    (`cities500.txt`, `cities1000.txt`, `allCountries.txt` from
+    https://download.geonames.org/export/dump/).
+    Only populated places (feature class `P`: cities, towns, villages) are used,
+    city districts and places that no longer exist are skipped.
+    Addresses are not resolved and left as they are.
+
+    Attributes:
+        names (np.ndarray): Names of the places.
+        country_codes (np.ndarray): Country codes of the places.
+        tree (cKDTree): KD-tree over places coordinates as unit vectors.
+    """
+
+    def __init__(self, path: str):
+        """Load places file into in-memory index.
+
+        Args:
+            path (str): The path to places file.
+        """
+        places = read_places(path)
+        self.names = places["name"].to_numpy()
+        self.country_codes = places["country_code"].to_numpy()
+        self.tree = cKDTree(
+            to_unit_vectors(
+                places["latitude"].to_numpy(), places["longitude"].to_numpy()
+            )
+        )
+
+    def nearest(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Find indices of the nearest places for arrays of coordinates.
+
+        The nearest place on the sphere is the one with the shortest chord
+        between unit vectors, so it is looked up in KD-tree.
+
+        Args:
+            lat (np.ndarray): Latitudes in degrees.
+            lon (np.ndarray): Longitudes in degrees.
+
+        Returns:
+            Array of indices in the index.
+        """
+        _, nearest = self.tree.query(to_unit_vectors(lat, lon))
+        return nearest
+
+    def reverse(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Get country code and nearest city for every line in dataframe.
+
+        Args:
+            df (pd.DataFrame): Dataframe with `Latitude`, `Longitude` and `Address` columns.
+
+        Returns:
+            Dataframe with `Address`, `Country` and `City` columns and the same index.
+        """
+        nearest = self.nearest(df["Latitude"].to_numpy(), df["Longitude"].to_numpy())
+        return pd.DataFrame(
+            {
+                "Address": df["Address"].to_numpy(),
+                "Country": self.country_codes[nearest],
+                "City": self.names[nearest],
+            },
+            index=df.index,
+        )
+
+
+def read_places(path: str) -> pd.DataFrame:
+    """Read populated places from GeoNames-style file.
+
+    Args:
+        path (str): The path to places file.
+
+    Returns:
+        Dataframe with name, coordinates and country code of populated places.
+    """
+    try:
+        places = pd.read_csv(
+            path,
+            sep="\t",
+            header=None,
+            usecols=list(geonames_columns),
+            quoting=csv.QUOTE_NONE,
+            keep_default_na=False,  # `NA` is a country code for Namibia
+            dtype={1: str, 4: np.float32, 5: np.float32, 6: str, 7: str, 8: str},
+        )
+    except FileNotFoundError:
+        quit()
+    places.rename(columns=geonames_columns, inplace=True)
+    places = places[
+        (places["feature_class"] == "P")
+        & ~places["feature_code"].isin(skipped_feature_codes)
+    ]
+    if places.empty:
+        quit()
+    return places.reset_index(drop=True)
+
+
+def to_unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Convert coordinates in degrees to the unit vectors.
+
+    Args:
+        lat (np.ndarray): Latitudes in degrees.
+        lon (np.ndarray): Longitudes in degrees.
+
+    Returns:
+        Array of unit vectors, shape (N, 3).
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack(
+        (np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat))
+    )
+
+
+def run_pool_of_address_workers(df: pd.DataFrame, pool: Pool) -> List:
+    """Run address_worker method in the multiprocessing pool.
+
+    Form a list of correct addresses, country codes and cities for given dataframe
+    in multiprocessing mode.
+
+    Args:
+        df (pd.DataFrame): Dataframe to process.
+        pool (Pool): Pool of processes to run at.
+
+    Returns:
+        List of tuples with address, county code and city for every line in dataframe.
+    """
+    return pool.map(address_worker, zip(df["Address"], df["City"]))
+
+
+def address_worker(data: Tuple) -> Tuple:
+    """Get the address, country code and city for given coordinates.
+
+    Args:
+        data (Tuple): Tuple of coordinates concatenated as strings and original `City`
+
+    Returns:
+        Tuple with valid address, country code and city for given coordinates.
+    """
+    coordinates_as_string = data[0]
+    original_city = data[1]
+    location = reverse_coords(coordinates_as_string)
+    country_code = location.raw["address"]["country_code"].upper()
+
+    if "city" in location.raw["address"]:
+        city = location.raw["address"]["city"]
+    elif "town" in location.raw["address"]:
+        city = location.raw["address"]["town"]
+    elif "village" in location.raw["address"]:
+        city = location.raw["address"]["village"]
+    else:
+        city = original_city
+    return location.address, country_code, city
@@ -1 +1,3 @@
 API_OW = "your_api_key_for_openweathermap.org"
+# keys for openweathermap.org with their per-minute and per-day request limits
+API_OW_KEYS = [(API_OW, 60, 1000)]
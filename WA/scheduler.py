@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple
+
+
+class QuotaExceededError(Exception):
+    """Raised when no API key has requests left for today."""
+
+
+class ApiKey:
+    """API key with its own request budget.
+
+    Attributes:
+        key (str): API key.
+        per_minute (int): Max number of requests per minute.
+        per_day (int): Max number of requests per day.
+        used_today (int): Number of requests done today.
+        day (str): The day `used_today` is counted for.
+        in_flight (int): Number of requests waiting for the response.
+        recent (deque): Timestamps of responses received during the last minute.
+    """
+
+    def __init__(self, key: str, per_minute: int, per_day: int):
+        self.key = key
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.used_today = 0
+        self.day = today()
+        self.in_flight = 0
+        self.recent = deque()
+
+    def remaining_today(self) -> int:
+        """Get number of requests left for today.
+
+        Returns:
+            Number of requests.
+        """
+        if self.day != today():
+            self.day = today()
+            self.used_today = 0
+        return max(0, self.per_day - self.used_today)
+
+    def free_at(self, now: float, minute: float) -> float:
+        """Get the time when the next request fits into per-minute budget.
+
+        Request takes its place in the budget from sending till the minute after
+        the response, so the server can not see it outside of this interval.
+
+        Args:
+            now (float): Current `time.monotonic()` value.
+            minute (float): Length of the rate limit window in seconds.
+
+        Returns:
+            `time.monotonic()` value, `now` if request can be done right away,
+            infinity if all the budget is taken by requests in flight.
+        """
+        while self.recent and self.recent[0] <= now - minute:
+            self.recent.popleft()
+        done = self.per_minute - self.in_flight
+        if len(self.recent) < done:
+            return now
+        if done <= 0:
+            return math.inf
+        return self.recent[-done] + minute
+
+
+class RequestScheduler:
+    """Spread requests across the pool of API keys within their budgets.
+
+    Requests wait for a free key in order of their priority, lower value goes first.
+    Key with most requests left for today is picked among the free ones.
+    Daily usage can be kept in JSON file to be shared between runs,
+    keys are stored there as hashes.
+
+    Attributes:
+        keys (List[ApiKey]): Pool of API keys.
+        usage_file (str): The path to daily usage file.
+    """
+
+    # length of the rate limit window in seconds
+    minute = 60.0
+
+    def __init__(
+        self, keys: Iterable[Tuple[str, int, int]], usage_file: Optional[str] = None
+    ):
+        """Set up the pool of API keys.
+
+        Args:
+            keys (Iterable[Tuple[str, int, int]]): API keys with per-minute and per-day limits.
+            usage_file (str): The path to daily usage file. Usage is not saved by default.
+        """
+        self.keys = [ApiKey(*key) for key in keys]
+        self.usage_file = usage_file
+        self.waiting = []
+        self.counter = itertools.count()
+        self.loop = None
+        self.timer = None
+        if usage_file:
+            self.load_usage()
+
+    def remaining_today(self) -> int:
+        """Get number of requests left for today for all keys.
+
+        Returns:
+            Number of requests.
+        """
+        return sum(key.remaining_today() for key in self.keys)
+
+    def fits(self, requests: int) -> bool:
+        """Check if number of requests fits into the remaining daily quota.
+
+        Args:
+            requests (int): Number of requests.
+
+        Returns:
+            True if requests can be done today.
+        """
+        return requests <= self.remaining_today()
+
+    async def acquire(self, priority: int = 0) -> str:
+        """Wait for the key which can do one more request and count the request.
+
+        Every acquired key has to be released when the response is received.
+
+        Args:
+            priority (int): Priority of the request, lower value goes first.
+
+        Returns:
+            API key.
+
+        Raises:
+            QuotaExceededError: No key has requests left for today.
+        """
+        if self.loop is not asyncio.get_running_loop():
+            self.loop = asyncio.get_running_loop()
+            self.waiting = []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        future = self.loop.create_future()
+        heapq.heappush(self.waiting, (priority, next(self.counter), future))
+        self.dispatch()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # key was given away, but the request will not be done
+                self.return_key(future.result())
+            raise
+
+    async def release(self, key: str, throttled: bool = False) -> None:
+        """Count the response to the request done with the key.
+
+        Args:
+            key (str): API key.
+            throttled (bool): Request was rejected by the server rate limit,
+                the key will not be used till the end of the minute.
+        """
+        now = time.monotonic()
+        for api_key in self.keys:
+            if api_key.key == key:
+                api_key.in_flight -= 1
+                api_key.recent.extend([now] * (api_key.per_minute if throttled else 1))
+        self.dispatch()
+
+    def return_key(self, key: str) -> None:
+        """Take back the key acquired for the request which was not done.
+
+        Args:
+            key (str): API key.
+        """
+        for api_key in self.keys:
+            if api_key.key == key:
+                api_key.in_flight -= 1
+                api_key.used_today -= 1
+        self.dispatch()
+
+    def dispatch(self) -> None:
+        """Give free keys to the requests from the head of the queue.
+
+        Only the head of the queue is checked, cancelled requests are dropped
+        when they get there. If no key is free, the check is repeated when
+        the next key is free or released.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.waiting:
+            future = self.waiting[0][2]
+            if future.done():
+                heapq.heappop(self.waiting)
+                continue
+            key, free_at = self.pick_key()
+            if key is not None:
+                heapq.heappop(self.waiting)
+                future.set_result(key.key)
+            elif free_at is None:
+                self.fail_waiting()
+            elif free_at != math.inf:
+                self.timer = self.loop.call_later(
+                    free_at - time.monotonic(), self.dispatch
+                )
+                return
+            else:
+                return
+
+    def fail_waiting(self) -> None:
+        """Fail all the waiting requests when the daily quota is used."""
+        for _, _, future in self.waiting:
+            if not future.done():
+                future.set_exception(
+                    QuotaExceededError("Daily quota of all API keys is used")
+                )
+        self.waiting = []
+
+    def pick_key(self) -> Tuple[Optional[ApiKey], Optional[float]]:
+        """Pick the key for the next request and count the request.
+
+        Returns:
+            Picked key or None and the time the next key will be free at,
+            both None if daily quota is used.
+        """
+        now = time.monotonic()
+        available = [key for key in self.keys if key.remaining_today()]
+        if not available:
+            return None, None
+        free = [key for key in available if key.free_at(now, self.minute) <= now]
+        if not free:
+            return None, min(key.free_at(now, self.minute) for key in available)
+        key = max(free, key=ApiKey.remaining_today)
+        key.in_flight += 1
+        key.used_today += 1
+        return key, now
+
+    def load_usage(self) -> None:
+        """Read daily usage of the keys from usage file."""
+        try:
+            with open(self.usage_file) as file:
+                usage = json.load(file)
+        except (OSError, ValueError):
+            # missing or damaged file, start counting from scratch
+            return
+        for key in self.keys:
+            day, used = usage.get(key_id(key.key), (None, 0))
+            if day == key.day:
+                key.used_today = used
+
+    def save_usage(self) -> None:
+        """Write daily usage of the keys to usage file, if it is set.
+
+        File is replaced at once, so interrupted write does not damage it.
+        """
+        if not self.usage_file:
+            return
+        usage = {key_id(key.key): (key.day, key.used_today) for key in self.keys}
+        temp_file = self.usage_file + ".tmp"
+        with open(temp_file, "w") as file:
+            json.dump(usage, file)
+        os.replace(temp_file, self.usage_file)
+
+
+def key_id(key: str) -> str:
+    """Get identifier of API key to store instead of the key itself.
+
+    Args:
+        key (str): API key.
+
+    Returns:
+        Beginning of SHA-256 hash of the key.
+    """
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def today() -> str:
+    """Get current day, daily quota of `openweathermap.org` is reset at UTC midnight.
+
+    Returns:
+        Current UTC date in ISO format.
+    """
+    return datetime.now(timezone.utc).date().isoformat()
@@ -0,0 +1,376 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import zipfile
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+import pandas as pd
+from analysis_methods import analysis_tasks
+from data_structures import (
+    CityCentres,
+    Hotels,
+    Weather,
+    get_weather,
+    requests_per_city,
+)
+from export_utility import export_address_data, save_plots
+from geocoders import Geocoder
+from geopy.exc import GeocoderServiceError
+from scheduler import QuotaExceededError, RequestScheduler
+
+# raw hotel data, any change of it requires new geocoding
+hotel_key_columns = ["Name", "Country", "City", "Latitude", "Longitude"]
+address_columns = ["Address", "Country", "City"]
+weather_columns = ["city", "day", "temp", "temp_min", "temp_max"]
+
+
+class AnalysisService:
+    """Long-running weather analysis with warm caches.
+
+    Geocoder, http session, request scheduler, resolved addresses, city centres
+    and weather data stay in memory between updates, so only new or changed hotels
+    are geocoded and only cities with new centres get new weather data.
+    All weather data is requested again once a day.
+
+    Attributes:
+        input_folder (str): The path to `hotels.zip` file.
+        output_folder (str): The path to desired folder for data export.
+        geocoder (Geocoder): Reverse geocoding backend.
+        scheduler (RequestScheduler): Scheduler of requests to `openweathermap.org`.
+        addresses (pd.DataFrame): Resolved addresses indexed by raw hotel data.
+        centres (pd.DataFrame): City centres from the last update.
+        hotel_counts (pd.Series): Number of hotels in every city from the last update.
+        weather (pd.DataFrame): Weather data from the last update.
+        weather_day (date): The day weather data was requested at.
+        signature (Tuple): Modification time and size of processed archive.
+        failed_signature (Tuple): Modification time and size of the broken archive.
+        unexported_cities (pd.MultiIndex): Cities with geocoded hotels not exported yet.
+    """
+
+    def __init__(
+        self,
+        input_folder: str,
+        output_folder: str,
+        geocoder: Geocoder,
+        scheduler: RequestScheduler,
+    ):
+        """Set up the service with empty caches.
+
+        Args:
+            input_folder (str): The path to `hotels.zip` file.
+            output_folder (str): The path to desired folder for data export.
+            geocoder (Geocoder): Reverse geocoding backend.
+            scheduler (RequestScheduler): Scheduler of requests to `openweathermap.org`.
+        """
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.geocoder = geocoder
+        self.scheduler = scheduler
+        self.addresses = pd.DataFrame(
+            columns=address_columns,
+            index=pd.MultiIndex.from_tuples([], names=hotel_key_columns),
+        )
+        self.centres = pd.DataFrame(columns=["center_lat", "center_lon"])
+        self.hotel_counts = pd.Series(dtype="int64")
+        self.weather = pd.DataFrame(columns=weather_columns)
+        self.weather_day = None
+        self.signature = None
+        self.failed_signature = None
+        self.unexported_cities = pd.MultiIndex.from_tuples(
+            [], names=["Country", "City"]
+        )
+        self.results = {}
+        self.status = {"state": "starting"}
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.session = self.loop.run_until_complete(open_session())
+
+    def update(self) -> bool:
+        """Process the archive if it was changed since the last update.
+
+        Failed update leaves the archive unprocessed, so it will be retried at the next one.
+
+        Returns:
+            True if any data was processed.
+        """
+        signature = archive_signature(self.input_folder)
+        if signature is None or signature == self.failed_signature:
+            return False
+        if signature == self.signature and self.weather_day == date.today():
+            return False
+
+        started = time.monotonic()
+        self.set_status(state="updating")
+        try:
+            status = self.process()
+        except SystemExit:
+            # `prepare_data` quits on the broken archive, wait for the next one
+            self.failed_signature = signature
+            self.set_status(state="error", error="Invalid archive")
+            return False
+        except zipfile.BadZipFile:
+            # archive is still being written, retry at the next check
+            self.set_status(state="waiting", error="Archive is not complete")
+            return False
+        except (
+            GeocoderServiceError,
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+            OSError,
+            KeyError,
+            ValueError,
+            QuotaExceededError,
+        ) as error:
+            self.set_status(state="error", error=repr(error))
+            return False
+        self.signature = signature
+        self.set_status(
+            state="idle",
+            last_update=datetime.now().isoformat(timespec="seconds"),
+            duration=round(time.monotonic() - started, 3),
+            error=None,
+            **status,
+        )
+        return True
+
+    def process(self) -> Dict:
+        """Read the archive and process the changes.
+
+        Resolved addresses are kept as soon as geocoding is done,
+        the rest of the caches are replaced only when all the data is processed.
+
+        Returns:
+            Dict with numbers of processed hotels and cities.
+        """
+        hotels = Hotels(self.input_folder)
+        keys = pd.MultiIndex.from_frame(hotels.df[hotel_key_columns])
+
+        # geocode new hotels only
+        new_hotels = ~keys.isin(self.addresses.index)
+        addresses = self.addresses[self.addresses.index.isin(keys)]
+        if new_hotels.any():
+            resolved = self.geocoder.reverse(hotels.df[new_hotels])
+            resolved.index = keys[new_hotels]
+            addresses = pd.concat([addresses, resolved])
+            addresses = addresses[~addresses.index.duplicated()]
+            self.unexported_cities = self.unexported_cities.union(
+                pd.MultiIndex.from_frame(resolved[["Country", "City"]])
+            )
+        self.addresses = addresses
+        hotels.df[address_columns] = addresses.reindex(keys).to_numpy()
+
+        # request weather for new and moved city centres only
+        city_centres = CityCentres(hotels)
+        centres = city_centres.df
+        today = date.today()
+        if self.weather_day == today:
+            previous = self.centres.reindex(centres.index)
+            coordinates = ["center_lat", "center_lon"]
+            moved = (previous[coordinates] != centres[coordinates]).any(axis=1)
+        else:
+            moved = pd.Series(True, index=centres.index)
+        kept = self.weather[self.weather["city"].isin(centres.index[~moved])]
+        city_centres.df = centres[moved]
+        if moved.any():
+            if not self.scheduler.fits(requests_per_city * int(moved.sum())):
+                raise QuotaExceededError("Update does not fit into daily quota")
+            fetched = self.loop.run_until_complete(
+                get_weather(city_centres, self.session, self.scheduler)
+            )
+            weather_df = pd.concat([kept, fetched], ignore_index=True)
+        else:
+            weather_df = kept.reset_index(drop=True)
+
+        # export data for changed cities only
+        cities = pd.MultiIndex.from_frame(hotels.df[["Country", "City"]])
+        hotel_counts = hotels.df.groupby(["Country", "City"]).size()
+        recounted = hotel_counts.ne(self.hotel_counts.reindex(hotel_counts.index))
+        changed_cities = self.unexported_cities.union(hotel_counts.index[recounted])
+        hotels.df = hotels.df[cities.isin(changed_cities)]
+        export_address_data(hotels, self.output_folder)
+
+        moved_weather = weather_df[weather_df["city"].isin(centres.index[moved])]
+        save_plots(Weather(city_centres, df=moved_weather), self.output_folder)
+        weather = Weather(city_centres, df=weather_df)
+        results = analysis_tasks(weather, self.output_folder)
+
+        self.unexported_cities = self.unexported_cities[:0]
+        self.centres = centres
+        self.hotel_counts = hotel_counts
+        self.weather = weather_df
+        self.weather_day = today
+        with self.lock:
+            self.results = {
+                name: json.loads(result.to_json(date_format="iso", default_handler=str))
+                for name, result in results.items()
+            }
+        return {
+            "hotels": len(keys),
+            "cities": len(centres),
+            "geocoded_hotels": int(new_hotels.sum()),
+            "updated_cities": int(moved.sum()),
+        }
+
+    def watch(self, interval: float) -> None:
+        """Check the archive for changes until interrupted.
+
+        Args:
+            interval (float): Seconds between checks.
+        """
+        while True:
+            try:
+                self.update()
+            except Exception as error:
+                # the service has to keep watching after any failure
+                self.set_status(state="error", error=repr(error))
+            time.sleep(interval)
+
+    def set_status(self, **status: object) -> None:
+        """Update run status.
+
+        Args:
+            status: Status fields to set.
+        """
+        with self.lock:
+            self.status = {**self.status, **status}
+
+    def get_status(self) -> Dict:
+        """Get run status.
+
+        Returns:
+            Copy of run status.
+        """
+        with self.lock:
+            return dict(self.status)
+
+    def get_results(self) -> Dict:
+        """Get results of the latest analysis tasks.
+
+        Returns:
+            Copy of analysis results.
+        """
+        with self.lock:
+            return dict(self.results)
+
+    def close(self) -> None:
+        """Close geocoder, http session and event loop."""
+        self.geocoder.close()
+        self.loop.run_until_complete(self.session.close())
+        self.loop.close()
+
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    """Serve run status and analysis results of the `server.service` as JSON.
+
+    Endpoints:
+        `/status`: run status;
+        `/results`: results of all analysis tasks;
+        `/results/<task>`: result of the single analysis task.
+    """
+
+    def do_GET(self):  # noqa: N802
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        if parts == ["status"]:
+            self.send_json(service.get_status())
+        elif parts == ["results"]:
+            self.send_json(service.get_results())
+        elif len(parts) == 2 and parts[0] == "results":
+            results = service.get_results()
+            if parts[1] in results:
+                self.send_json(results[parts[1]])
+            else:
+                self.send_error(404)
+        else:
+            self.send_error(404)
+
+    def send_json(self, data: Dict) -> None:
+        """Send data as JSON response.
+
+        Args:
+            data (Dict): Data to send.
+        """
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args: object):  # noqa: A002
+        pass
+
+
+def serve_status(service: AnalysisService, port: int) -> ThreadingHTTPServer:
+    """Start local HTTP server with service status in the background thread.
+
+    Args:
+        service (AnalysisService): Service to report about.
+        port (int): Port to listen at `localhost`.
+
+    Returns:
+        Running server.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StatusRequestHandler)
+    server.service = service
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_service(
+    input_folder: str,
+    output_folder: str,
+    geocoder: Geocoder,
+    scheduler: RequestScheduler,
+    interval: float,
+    port: int,
+) -> None:
+    """Run the service until interrupted.
+
+    Args:
+        input_folder (str): The path to `hotels.zip` file.
+        output_folder (str): The path to desired folder for data export.
+        geocoder (Geocoder): Reverse geocoding backend.
+        scheduler (RequestScheduler): Scheduler of requests to `openweathermap.org`.
+        interval (float): Seconds between archive checks.
+        port (int): Port of status server.
+    """
+    service = AnalysisService(input_folder, output_folder, geocoder, scheduler)
+    server = serve_status(service, port)
+    try:
+        service.watch(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        service.close()
+
+
+def archive_signature(input_folder: str) -> Optional[Tuple]:
+    """Get modification time and size of `hotels.zip` file.
+
+    Args:
+        input_folder (str): The path to `hotels.zip` file.
+
+    Returns:
+        Tuple with modification time and size, None if there is no archive.
+    """
+    try:
+        stat = os.stat(input_folder + "/hotels.zip")
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+async def open_session() -> aiohttp.ClientSession:
+    """Open http session inside of the running event loop.
+
+    Returns:
+        New http session.
+    """
+    return aiohttp.ClientSession()
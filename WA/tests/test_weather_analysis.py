@@ -1,14 +1,28 @@
+import asyncio
+import json
 import os
+import threading
+import time
+import zipfile
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pandas as pd
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
+import WA.data_structures
 from WA.analysis_methods import (
     get_city_and_day_with_max_temp,
     get_city_and_day_with_min_temp,
     get_city_with_biggest_max_temp_change,
     get_max_daily_temp_change,
 )
-from WA.data_structures import CityCentres, Hotels
+from WA.data_structures import CityCentres, Hotels, get_weather, requests_per_city
+from WA.geocoders import OfflineGeocoder
+from WA.scheduler import QuotaExceededError, RequestScheduler
+from WA.service import AnalysisService
 
 path = os.path.dirname(__file__)
 
@@ -42,6 +56,332 @@ def test_calc_city_centres():
     assert centres.df.equals(correct_centre_coordinates_df)
 
 
+def test_offline_geocoder_fills_country_and_city():
+    hotels = Hotels(path + "/test_hotels_class")
+    hotels.df["Country"] = ["XX"]
+    hotels.df["City"] = ["Nowhere"]
+    geocoder = OfflineGeocoder(path + "/test_offline_geocoder/places.txt")
+    hotels.fill_address(processes=1, geocoder=geocoder)
+    assert hotels.df.loc[0, "Country"] == "ES"
+    assert hotels.df.loc[0, "City"] == "Barcelona"
+    assert hotels.df.loc[0, "Address"] == "41.3971434, 2.1921947"
+
+
+def test_offline_geocoder_nearest():
+    geocoder = OfflineGeocoder(path + "/test_offline_geocoder/places.txt")
+    nearest = geocoder.nearest([48.8, -22.0, 40.0, 41.4], [2.3, 17.0, -3.0, 2.2])
+    assert list(geocoder.names[nearest]) == ["Paris", "Windhoek", "Madrid", "Barcelona"]
+    assert list(geocoder.country_codes[nearest]) == ["FR", "NA", "ES", "ES"]
+
+
+def write_hotels_archive(folder, lines):
+    with zipfile.ZipFile(folder / "hotels.zip", "w") as myzip:
+        myzip.writestr(
+            "hotels.csv", "Id,Name,Country,City,Latitude,Longitude\n" + "\n".join(lines)
+        )
+
+
+def test_service_processes_only_changes(tmp_path, monkeypatch):
+    requested = []
+
+    async def fake_get_weather(city_centres, session, scheduler):
+        requested.extend(city_centres.df.index)
+        return pd.DataFrame(
+            [
+                {
+                    "city": city,
+                    "day": "2021-05-25",
+                    "temp": 1,
+                    "temp_min": 0,
+                    "temp_max": 2,
+                }
+                for city in city_centres.df.index
+            ]
+        )
+
+    monkeypatch.setattr("WA.service.get_weather", fake_get_weather)
+    geocoder = OfflineGeocoder(path + "/test_offline_geocoder/places.txt")
+    scheduler = RequestScheduler([("key", 60, 1000)])
+    service = AnalysisService(str(tmp_path), str(tmp_path), geocoder, scheduler)
+    try:
+        assert not service.update()
+
+        write_hotels_archive(tmp_path, ["1,Spa,ES,Barcelona,41.3971434,2.1921947"])
+        assert service.update()
+        assert requested == [("ES", "Barcelona")]
+        assert not service.update()
+
+        write_hotels_archive(
+            tmp_path,
+            [
+                "1,Spa,ES,Barcelona,41.3971434,2.1921947",
+                "2,Louvre,FR,Paris,48.86,2.33",
+                "3,Broken,FR,Paris,91,2.33",
+            ],
+        )
+        os.utime(tmp_path / "hotels.zip", ns=(0, 0))
+        assert service.update()
+        assert requested == [("ES", "Barcelona"), ("FR", "Paris")]
+        status = service.get_status()
+        assert status["state"] == "idle"
+        assert status["hotels"] == 2
+        assert status["geocoded_hotels"] == 1
+        assert status["updated_cities"] == 1
+        assert service.get_results()["coldest_city_and_day"]["temp"] == 1
+    finally:
+        service.close()
+
+
+def test_service_waits_for_new_archive_after_broken_one(tmp_path, monkeypatch):
+    def broken_hotels(folder):
+        raise SystemExit
+
+    monkeypatch.setattr("WA.service.Hotels", broken_hotels)
+    geocoder = OfflineGeocoder(path + "/test_offline_geocoder/places.txt")
+    scheduler = RequestScheduler([("key", 60, 1000)])
+    service = AnalysisService(str(tmp_path), str(tmp_path), geocoder, scheduler)
+    try:
+        write_hotels_archive(tmp_path, ["broken"])
+        assert not service.update()
+        assert service.get_status()["error"] == "Invalid archive"
+        monkeypatch.setattr("WA.service.Hotels", lambda folder: pytest.fail())
+        assert not service.update()
+    finally:
+        service.close()
+
+
+def test_service_retries_archive_being_written(tmp_path, monkeypatch):
+    async def fake_get_weather(city_centres, session, scheduler):
+        return pd.DataFrame(
+            [
+                {
+                    "city": city,
+                    "day": "2021-05-25",
+                    "temp": 1,
+                    "temp_min": 0,
+                    "temp_max": 2,
+                }
+                for city in city_centres.df.index
+            ]
+        )
+
+    monkeypatch.setattr("WA.service.get_weather", fake_get_weather)
+    geocoder = OfflineGeocoder(path + "/test_offline_geocoder/places.txt")
+    scheduler = RequestScheduler([("key", 60, 1000)])
+    service = AnalysisService(str(tmp_path), str(tmp_path), geocoder, scheduler)
+    try:
+        write_hotels_archive(tmp_path, ["1,Spa,ES,Barcelona,41.3971434,2.1921947"])
+        archive = (tmp_path / "hotels.zip").read_bytes()
+        (tmp_path / "hotels.zip").write_bytes(archive[: len(archive) // 2])
+        assert not service.update()
+        assert service.get_status()["state"] == "waiting"
+
+        (tmp_path / "hotels.zip").write_bytes(archive)
+        assert service.update()
+        assert service.get_status()["state"] == "idle"
+    finally:
+        service.close()
+
+
+def test_service_keeps_addresses_after_failed_update(tmp_path):
+    class CountingGeocoder(OfflineGeocoder):
+        geocoded = 0
+
+        def reverse(self, df):
+            self.geocoded += len(df)
+            return super().reverse(df)
+
+    geocoder = CountingGeocoder(path + "/test_offline_geocoder/places.txt")
+    scheduler = RequestScheduler([("key", 60, 1)])
+    service = AnalysisService(str(tmp_path), str(tmp_path), geocoder, scheduler)
+    try:
+        write_hotels_archive(tmp_path, ["1,Spa,ES,Barcelona,41.3971434,2.1921947"])
+        assert not service.update()
+        assert "QuotaExceededError" in service.get_status()["error"]
+        assert not service.update()
+        assert geocoder.geocoded == 1
+    finally:
+        service.close()
+
+
+def test_failed_service_update_leaves_no_pending_requests(tmp_path, monkeypatch):
+    requests = []
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            requests.append(self.path)
+            if "timemachine" in self.path:
+                time.sleep(0.2)
+                current = {"dt": 1622000000, "temp": 8}
+                body = {"current": current, "hourly": [{"temp": 8}]}
+            elif "lat=48" in self.path:
+                body = {}
+            else:
+                main = {"temp": 10, "temp_min": 5, "temp_max": 15}
+                body = {"list": [{"dt": 1622000000, "main": main}] * 40}
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):  # noqa: A002
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr("data_structures.ow_url_forecast", url + "/forecast")
+    monkeypatch.setattr("data_structures.ow_url_historical", url + "/timemachine")
+
+    geocoder = OfflineGeocoder(path + "/test_offline_geocoder/places.txt")
+    scheduler = RequestScheduler([("key", 60, 1000)])
+    service = AnalysisService(str(tmp_path), str(tmp_path), geocoder, scheduler)
+    try:
+        write_hotels_archive(
+            tmp_path,
+            [
+                "1,Spa,ES,Barcelona,41.3971434,2.1921947",
+                "2,Louvre,FR,Paris,48.86,2.33",
+            ],
+        )
+        assert not service.update()
+        assert service.get_status()["error"] == "KeyError('list')"
+        assert not asyncio.all_tasks(service.loop)
+        sent = len(requests)
+        service.loop.run_until_complete(asyncio.sleep(0.3))
+        assert len(requests) == sent
+    finally:
+        service.close()
+        server.shutdown()
+
+
+def test_scheduler_spreads_requests_and_checks_quota():
+    scheduler = RequestScheduler([("first", 10, 3), ("second", 10, 2)])
+    assert scheduler.fits(5)
+    assert not scheduler.fits(6)
+
+    async def acquire_all():
+        return [await scheduler.acquire() for _ in range(5)]
+
+    keys = asyncio.run(acquire_all())
+    assert keys == ["first", "first", "second", "first", "second"]
+    assert scheduler.remaining_today() == 0
+    with pytest.raises(QuotaExceededError):
+        asyncio.run(scheduler.acquire())
+
+
+def test_scheduler_paces_requests_by_priority():
+    scheduler = RequestScheduler([("key", 1, 100)])
+    scheduler.minute = 0.1
+    order = []
+
+    async def request(priority):
+        key = await scheduler.acquire(priority)
+        order.append(priority)
+        await scheduler.release(key)
+
+    async def run():
+        await request(0)
+        await asyncio.gather(*(request(priority) for priority in (5, 1, 3)))
+
+    started = time.monotonic()
+    asyncio.run(run())
+    assert order == [0, 1, 3, 5]
+    assert time.monotonic() - started >= 0.3
+
+
+def test_scheduler_survives_cancelled_request():
+    scheduler = RequestScheduler([("key", 1, 100)])
+    scheduler.minute = 0.05
+
+    async def run():
+        key = await scheduler.acquire()
+        waiting = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        await scheduler.release(key)
+        return await asyncio.wait_for(scheduler.acquire(), 1)
+
+    assert asyncio.run(run()) == "key"
+    assert not scheduler.waiting
+
+
+def test_scheduler_ignores_damaged_usage_file(tmp_path):
+    usage_file = str(tmp_path / "usage.json")
+    with open(usage_file, "w") as file:
+        file.write('{"0123456789abcdef": ["20')
+    scheduler = RequestScheduler([("key", 60, 100)], usage_file)
+    assert scheduler.remaining_today() == 100
+
+    scheduler.keys[0].used_today = 10
+    scheduler.save_usage()
+    assert os.listdir(tmp_path) == ["usage.json"]
+    assert RequestScheduler([("key", 60, 100)], usage_file).remaining_today() == 90
+
+
+def test_get_weather_stays_within_limits_of_stand_in_server(tmp_path, monkeypatch):
+    per_window, window = 3, 0.2
+    requests = defaultdict(list)
+    rejected = []
+
+    def check_limit(request):
+        key, now = request.query["appid"], time.monotonic()
+        requests[key] = [stamp for stamp in requests[key] if stamp > now - window]
+        if len(requests[key]) >= per_window:
+            rejected.append(key)
+            raise web.HTTPTooManyRequests()
+        requests[key].append(now)
+
+    async def forecast(request):
+        check_limit(request)
+        main = {"temp": 10, "temp_min": 5, "temp_max": 15}
+        days = [{"dt": 1622000000 + 10800 * i, "main": main} for i in range(40)]
+        return web.json_response({"list": days})
+
+    async def history(request):
+        check_limit(request)
+        current = {"dt": int(request.query["dt"]), "temp": 8}
+        return web.json_response({"current": current, "hourly": [{"temp": 8}]})
+
+    app = web.Application()
+    app.router.add_get("/forecast", forecast)
+    app.router.add_get("/timemachine", history)
+
+    hotels = Hotels(path + "/test_calc_city_centres")
+    centres = CityCentres(hotels)
+    usage_file = str(tmp_path / "usage.json")
+    scheduler = RequestScheduler([("first", 3, 100), ("second", 3, 100)], usage_file)
+    scheduler.minute = window
+    # budget of the first key is already used by somebody else
+    requests["first"] = [time.monotonic()] * per_window
+
+    async def run():
+        async with TestServer(app) as server:
+            monkeypatch.setattr(
+                WA.data_structures, "ow_url_forecast", str(server.make_url("/forecast"))
+            )
+            monkeypatch.setattr(
+                WA.data_structures,
+                "ow_url_historical",
+                str(server.make_url("/timemachine")),
+            )
+            return await get_weather(centres, scheduler=scheduler)
+
+    weather = asyncio.run(run())
+    assert len(weather) == 22
+    assert set(requests) == {"first", "second"}
+    assert set(rejected) == {"first"}
+    used = len(centres.df) * requests_per_city + len(rejected)
+    next_run = RequestScheduler([("first", 3, 100), ("second", 3, 100)], usage_file)
+    assert next_run.remaining_today() == 200 - used
+    with open(usage_file) as file:
+        assert "first" not in file.read()
+
+
 test_data = {
     "Unnamed: 0": [0, 1, 2, 3, 4, 5, 6, 7, 8],
     "city": [
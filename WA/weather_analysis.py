@@ -2,8 +2,12 @@ import os
 
 import click
 from analysis_methods import analysis_tasks
-from data_structures import CityCentres, Hotels, Weather
+from data_structures import CityCentres, Hotels, Weather, requests_per_city
 from export_utility import export_address_data, save_plots
+from geocoders import NominatimGeocoder, OfflineGeocoder
+from keys import API_OW_KEYS
+from scheduler import RequestScheduler
+from service import run_service
 
 
 @click.command()
@@ -26,7 +30,54 @@ from export_utility import export_address_data, save_plots
     default=lambda: os.cpu_count(),
     help="Number of processes to run",
 )
-def main(input_folder, output_folder, processes):
+@click.option(
+    "--places-file",
+    "-pf",
+    default=None,
+    help="Enter a path to GeoNames-style places file to resolve countries and cities offline",
+)
+@click.option(
+    "--full-address",
+    "-fa",
+    is_flag=True,
+    help="Request full street addresses from Nominatim even if places file is provided",
+)
+@click.option(
+    "--watch",
+    "-w",
+    is_flag=True,
+    help="Keep running, process changes of 'Hotels.zip' and serve run status over HTTP",
+)
+@click.option(
+    "--interval",
+    "-i",
+    type=float,
+    default=60,
+    help="Seconds between 'Hotels.zip' checks in watch mode",
+)
+@click.option(
+    "--port",
+    type=int,
+    default=8765,
+    help="Port of local status server in watch mode",
+)
+@click.option(
+    "--usage-file",
+    "-uf",
+    default=None,
+    help="Enter a path to JSON file to keep daily usage of openweathermap.org keys between runs",
+)
+def main(
+    input_folder,
+    output_folder,
+    processes,
+    places_file,
+    full_address,
+    watch,
+    interval,
+    port,
+    usage_file,
+):
     r"""Weather analysis.
 
     The purpose of this programm is to process provided data (`hotels.zip`),
@@ -40,15 +91,31 @@ def main(input_folder, output_folder, processes):
     All gathered and calculated data will be saved at the output folder and will
     have following structure: `output_folder\country\city\`
     """
+    if places_file and not full_address:
+        geocoder = OfflineGeocoder(places_file)
+    else:
+        geocoder = NominatimGeocoder(processes)
+    scheduler = RequestScheduler(API_OW_KEYS, usage_file)
+    if watch:
+        run_service(input_folder, output_folder, geocoder, scheduler, interval, port)
+        return
+
     hotels = Hotels(input_folder)
 
-    hotels.fill_address(processes)
+    hotels.fill_address(processes, geocoder)
+    geocoder.close()
 
     export_address_data(hotels, output_folder)
 
     city_centres = CityCentres(hotels)
 
-    weather = Weather(city_centres)
+    requests = requests_per_city * len(city_centres.df)
+    if not scheduler.fits(requests):
+        raise click.ClickException(
+            f"{requests} requests to openweathermap.org are needed, "
+            f"only {scheduler.remaining_today()} are left for today"
+        )
+    weather = Weather(city_centres, scheduler)
 
     analysis_tasks(weather, output_folder)
 